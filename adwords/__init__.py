@@ -9,8 +9,9 @@ from adwords import (
     Ad, AdGroup, Base, Client, Campaign, DynamicSearchAd, ExpandedTextAd,
     Label,
 )
+from snapshot import Snapshot
 
 __all__ = [
     'Ad', 'AdGroup', 'Base', 'Client', 'Campaign', 'DynamicSearchAd',
-    'ExpandedTextAd', 'Label',
+    'ExpandedTextAd', 'Label', 'Snapshot',
 ]
@@ -9,8 +9,11 @@ import googleads
 import config
 import csv
 
+from batch import BatchJob
 from collections import defaultdict
+from journal import Journal
 from log import logging
+from snapshot import write_snapshot
 
 
 class Base(object):
@@ -38,12 +41,20 @@ class Label(Base):
 class Client(object):
     """ AdWords client """
 
-    def __init__(self, client_customer_id=None, version='v201705'):
+    def __init__(self, client_customer_id=None, version='v201705',
+                 journal=None):
         self.client = googleads.adwords.AdWordsClient.LoadFromStorage()
         self.downloader = self.client.GetReportDownloader()
         self.dynamic_params = defaultdict(dict)
         self.version = version
 
+        # Optional write-ahead journal of mutate operations, given as a path
+        # to the journal file, which allows resuming interrupted runs
+        self.journal = Journal(journal) if journal is not None else None
+
+        # Batch job collecting mutate operations while in bulk mode
+        self.batch = None
+
         # Client customer ID, if needed, can be obtained either from
         # credentials storage or set explicitly when creating new object
         if client_customer_id is not None:
@@ -53,6 +64,121 @@ class Client(object):
         """ Return AdWords service by name """
         return self.client.GetService(name, self.version)
 
+    def mutate(self, name, operations, key=None):
+        """
+        Send operations to AdWords service by name. If journal is enabled,
+        the call is recorded before being sent and marked as applied or failed
+        depending on the outcome. If `key' is given and the journal shows the
+        call identified by it as applied or submitted to a batch job already,
+        it is skipped. In bulk mode, operations are added to the current batch
+        job instead.
+        """
+        if self.journal is None:
+            if self.batch is not None:
+                return self.batch.add(name, operations)
+            return self.service(name).mutate(operations)
+
+        if self.journal.state(key) in ['applied', 'submitted']:
+            logging.info('Call {0} already handled, skipping'.format(key))
+            return None
+
+        key = self.journal.plan(name, operations, key=key)
+
+        return self._send(name, operations, key)
+
+    def _send(self, name, operations, key, chunk_size=None):
+        """
+        Send journalled call identified by `key', split into chunks of at
+        most `chunk_size' operations if given
+        """
+        if self.batch is not None:
+            return self.batch.add(name, operations, key=key)
+
+        chunk_size = chunk_size or len(operations) or 1
+        response = None
+
+        for start in range(0, len(operations), chunk_size):
+            try:
+                response = self.service(name).mutate(
+                    operations[start:start + chunk_size]
+                )
+            except Exception:
+                # Chunks sent before have been applied
+                self.journal.mark_failed(
+                    key, indices=range(start, len(operations))
+                )
+                raise
+
+        self.journal.mark_applied([key])
+
+        return response
+
+    def start_batch(self, chunk_size=None):
+        """
+        Switch to bulk mode. All subsequent mutate operations are uploaded to
+        a new batch job in chunks of `chunk_size' until `submit_batch' is
+        called.
+        """
+        self.batch = BatchJob(self, chunk_size=chunk_size)
+        return self.batch
+
+    def submit_batch(self):
+        """
+        Submit current batch job for processing and leave bulk mode. Return
+        the job so that its status and results can be checked later, or None
+        if no operations were added to it.
+        """
+        batch, self.batch = self.batch, None
+        if batch is None or not batch.submit():
+            return None
+
+        return batch
+
+    def resume(self, retry_failed=False):
+        """
+        Replay calls left pending in the journal by previous run, each on its
+        own and split into chunks of at most `MUTATE_OPERATIONS_LIMIT'
+        operations. If `retry_failed' is set, calls which failed before are
+        replayed as well. Calls which fail again are logged and marked as
+        failed, so that they can be discarded using `Journal.discard'. In bulk
+        mode, operations are added to the current batch job.
+
+        Calls submitted to batch jobs are not replayed. Instead, the jobs are
+        polled and the outcome of those which are done is recorded. Return
+        list of jobs still running, which can be polled later.
+        """
+        if self.journal is None:
+            return []
+
+        running = []
+        for id, calls in self.journal.submitted():
+            job = BatchJob.attach(self, id, calls)
+            try:
+                if not job.done():
+                    running.append(job)
+            except Exception as error:
+                logging.error(
+                    'Checking batch job {0} failed: {1}'.format(id, error)
+                )
+
+        for key, name, operations in self.journal.pending(retry_failed):
+            logging.info(
+                'Replaying {0} operations of call {1} for {2}'.format(
+                    len(operations), key, name)
+            )
+
+            try:
+                self._send(
+                    name, operations, key,
+                    chunk_size=config.MUTATE_OPERATIONS_LIMIT,
+                )
+            except Exception as error:
+                logging.error(
+                    'Replaying call {0} failed: {1}'.format(key, error)
+                )
+
+        return running
+
     def campaigns(self, labels=[]):
         """
         Return campaigns for the account. If `labels' is given, filter only
@@ -150,8 +276,21 @@ class Client(object):
 
         return labels
 
-    def upload_dynamic_params(self):
-        """ Upload dynamic ad parameters to AdWords """
+    def snapshot(self, path, labels=[]):
+        """
+        Write campaigns of the account together with their ad groups, ads,
+        keywords and URLs to snapshot file, which can be loaded later using
+        `Snapshot' without making any API calls. If `labels' is given, only
+        campaigns containing at least one of them are included.
+        """
+        write_snapshot(path, self.campaigns(labels))
+
+    def upload_dynamic_params(self, key=None):
+        """
+        Upload dynamic ad parameters to AdWords. If `key' is given, it is used
+        to identify the upload in the journal, so that a re-run skips steps
+        which have been applied already.
+        """
         # Return if there is nothing to upload
         if not self.dynamic_params:
             return
@@ -226,7 +365,10 @@ class Client(object):
                 for feed_item_id in feed_item_ids
             ]
 
-            service.mutate(operations)
+            self.mutate(
+                'FeedItemService', operations,
+                key='{0}-remove'.format(key) if key is not None else None,
+            )
 
         # Upload fresh values to the feed
         operations = [
@@ -250,7 +392,10 @@ class Client(object):
             for ad_group_id in self.dynamic_params
         ]
 
-        service.mutate(operations)
+        self.mutate(
+            'FeedItemService', operations,
+            key='{0}-add'.format(key) if key is not None else None,
+        )
 
 
 class Campaign(Base):
@@ -511,10 +656,12 @@ class AdGroup(Base):
 
         return self._keywords
 
-    def upload_ad(self, ad):
-        """ Upload new ad to the ad group """
-        service = self.client.service('AdGroupAdService')
-
+    def upload_ad(self, ad, key=None):
+        """
+        Upload new ad to the ad group. If `key' is given, it is used to
+        identify the upload in the journal, so that a re-run skips ads which
+        have been uploaded already.
+        """
         if isinstance(ad, ExpandedTextAd):
             ad_fields = {
                 'xsi_type': 'ExpandedTextAd',
@@ -548,7 +695,7 @@ class AdGroup(Base):
             },
         ]
 
-        service.mutate(operations)
+        self.client.mutate('AdGroupAdService', operations, key=key)
 
 
 class Ad(object):
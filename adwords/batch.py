@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous bulk uploads through AdWords BatchJobService
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import config
+import urllib2
+
+from collections import defaultdict
+from log import logging
+from xml.etree import cElementTree as ElementTree
+
+
+# Operation types corresponding to services whose mutate calls can be
+# redirected to a batch job
+OPERATION_TYPES = {
+    'AdGroupAdService': 'AdGroupAdOperation',
+    'FeedItemService': 'FeedItemOperation',
+}
+
+
+def _local_name(name):
+    """ Strip namespace from XML tag or attribute name """
+    return name.rsplit('}', 1)[-1]
+
+
+def _element_to_dict(element):
+    """
+    Convert XML element into nested dictionaries. Attributes are prefixed
+    with `@' and repeated tags are collected into lists.
+    """
+    children = list(element)
+    if not children and not element.attrib:
+        return element.text
+
+    data = dict(
+        ('@' + _local_name(name), value)
+        for name, value in element.attrib.items()
+    )
+    for child in children:
+        tag = _local_name(child.tag)
+        value = _element_to_dict(child)
+        if tag not in data:
+            data[tag] = value
+        elif isinstance(data[tag], list):
+            data[tag].append(value)
+        else:
+            data[tag] = [data[tag], value]
+
+    return data
+
+
+class BatchJob(object):
+    """
+    AdWords batch job. Operations are uploaded incrementally in chunks as they
+    are added, the job is processed on the server and its results can be
+    retrieved once it is done without blocking the caller in the meantime.
+    The job itself is only created on the server when the first operations
+    are added.
+    """
+
+    def __init__(self, client, chunk_size=None):
+        self.client = client
+        self.chunk_size = chunk_size or config.BATCH_UPLOAD_CHUNK_SIZE
+
+        self.id = None
+        self.status = None
+        self.download_url = None
+
+        self._upload = None
+        self._buffer = []
+        self._submitted = False
+
+        # Journal keys of calls whose operations were added to the job along
+        # with the number of operations in each, in the order in which they
+        # were added, used to record the outcome once the job is done
+        self._calls = []
+
+    @classmethod
+    def attach(cls, client, id, calls):
+        """
+        Return object for batch job with given ID submitted before, e.g. by
+        an interrupted run, with `calls' as recorded in the journal
+        """
+        job = cls(client)
+        job.id = id
+        job._calls = calls
+        job._submitted = True
+
+        return job
+
+    def _create(self):
+        """ Create the job on the server """
+        service = self.client.service('BatchJobService')
+        response = service.mutate([{'operator': 'ADD', 'operand': {}}])
+        job = response['value'][0]
+
+        self.id = job['id']
+        self.status = job['status']
+
+        helper = self.client.client.GetBatchJobHelper(
+            version=self.client.version
+        )
+        self._upload = helper.GetIncrementalUploadHelper(
+            job['uploadUrl']['url']
+        )
+
+    def add(self, name, operations, key=None):
+        """
+        Add operations for AdWords service by name to the job. Full chunks
+        are uploaded right away, the rest is kept until more operations are
+        added or the job is submitted. If `key' is given, it identifies the
+        call in the journal.
+        """
+        if self._submitted:
+            raise RuntimeError(
+                'Batch job {0} already submitted'.format(self.id)
+            )
+
+        if not operations:
+            return
+
+        if self._upload is None:
+            self._create()
+
+        operation_type = OPERATION_TYPES[name]
+        for operation in operations:
+            operation = dict(operation, xsi_type=operation_type)
+            self._buffer.append(operation)
+
+        self._calls.append([key, len(operations)])
+
+        # Always keep at least one operation in the buffer so that the last
+        # upload, which closes the job, is never empty
+        while len(self._buffer) > self.chunk_size:
+            self._upload.UploadOperations([self._buffer[:self.chunk_size]])
+            del self._buffer[:self.chunk_size]
+
+    def submit(self):
+        """
+        Upload remaining operations and start processing the job. Return
+        False if there was nothing to submit.
+        """
+        if self._submitted:
+            return True
+
+        if not self._buffer:
+            logging.warning('Batch job contains no operations, skipping')
+            return False
+
+        self._upload.UploadOperations([self._buffer], is_last=True)
+        self._buffer = []
+        self._submitted = True
+
+        # Operations are now processed by the server, so a resumed run must
+        # wait for their outcome rather than send them again
+        journal = self.client.journal
+        if journal is not None and self._journalled():
+            journal.mark_submitted(self.id, self._calls)
+
+        return True
+
+    def _journalled(self):
+        """ Check if any operations of the job are recorded in journal """
+        return any(key is not None for key, _ in self._calls)
+
+    def done(self):
+        """
+        Check current job status on the server. Return True once the job has
+        finished, otherwise return immediately with False. When the job is
+        first seen finished, outcome of its operations is recorded in the
+        journal.
+        """
+        if not self._submitted:
+            raise RuntimeError('Batch job not submitted yet')
+
+        if self.download_url is not None:
+            return True
+
+        service = self.client.service('BatchJobService')
+        selector = {
+            'fields': ['Id', 'Status', 'DownloadUrl'],
+            'predicates': [
+                {
+                    'field': 'Id',
+                    'operator': 'EQUALS',
+                    'values': [self.id],
+                },
+            ],
+        }
+
+        job = service.get(selector).entries[0]
+        self.status = job['status']
+
+        if self.status == 'CANCELED':
+            journal = self.client.journal
+            if journal is not None:
+                for key, _ in self._calls:
+                    journal.mark_failed(key)
+            raise RuntimeError('Batch job {0} was canceled'.format(self.id))
+
+        # Job only counts as done once its outcome has been recorded, so that
+        # the next call retries if recording fails
+        if self.status == 'DONE' and dict(job).get('downloadUrl'):
+            download_url = job['downloadUrl']['url']
+            self._commit(download_url)
+            self.download_url = download_url
+
+        return self.download_url is not None
+
+    def _commit(self, download_url):
+        """ Mark calls as applied or failed in the journal """
+        journal = self.client.journal
+        if journal is None or not self._journalled():
+            return
+
+        starts = []
+        start = 0
+        for _, count in self._calls:
+            starts.append(start)
+            start += count
+
+        # Positions of failed operations within their calls
+        failed = defaultdict(list)
+
+        for index, _, errors in self._parse(download_url):
+            if errors:
+                call = bisect.bisect_right(starts, index) - 1
+                failed[call].append(index - starts[call])
+
+        journal.mark_applied([
+            key for call, (key, _) in enumerate(self._calls)
+            if key is not None and call not in failed
+        ])
+        for call, indices in failed.items():
+            key = self._calls[call][0]
+            if key is not None:
+                journal.mark_failed(key, indices=indices)
+
+    def _parse(self, download_url):
+        """
+        Download results of the finished job and parse them incrementally,
+        yielding (index, result, errors) tuples as they are read
+        """
+        response = urllib2.urlopen(download_url)
+
+        try:
+            root = None
+            events = ElementTree.iterparse(response, events=('start', 'end'))
+
+            for event, element in events:
+                if root is None:
+                    root = element
+                if event != 'end' or _local_name(element.tag) != 'rval':
+                    continue
+
+                data = _element_to_dict(element)
+
+                # Drop parsed results so that memory use stays constant
+                root.clear()
+
+                errors = (data.get('errorList') or {}).get('errors', [])
+                if not isinstance(errors, list):
+                    errors = [errors]
+
+                yield int(data['index']), data.get('result'), errors
+        finally:
+            response.close()
+
+    def results(self):
+        """
+        Yield results of the finished job as (index, result, errors) tuples,
+        one for each operation in the order in which they were added. Results
+        are downloaded anew on each call. With journal enabled, they have
+        been downloaded once more by `done' to record the outcome, which
+        keeps memory use constant regardless of the size of the job.
+        """
+        if not self.done():
+            raise RuntimeError('Batch job {0} not done yet'.format(self.id))
+
+        for result in self._parse(self.download_url):
+            yield result
@@ -15,3 +15,13 @@ PATH2_LIMIT = 15
 
 # Length limits for Dynamic Search Ad fields
 DSA_DESCRIPTION_LIMIT = 80
+
+# Number of operations uploaded to a batch job at once
+BATCH_UPLOAD_CHUNK_SIZE = 1000
+
+# File to write log to, or None to log to console only
+LOG_FILE = None
+
+# Maximum number of operations sent in a single mutate call when replaying
+# journalled calls
+MUTATE_OPERATIONS_LIMIT = 5000
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Write-ahead journal for AdWords mutate operations
+"""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import uuid
+
+from collections import OrderedDict
+
+
+class Journal(object):
+    """
+    On-disk journal of mutate calls. Every call is recorded together with its
+    operations as planned before it is sent to AdWords and marked as applied
+    once the server acknowledges it, so that an interrupted run can be resumed
+    by replaying only the calls which are still pending. Calls rejected by the
+    server are marked as failed and kept until they are retried or discarded.
+
+    Each call is identified by a key. Callers can pass a stable key of their
+    own, such as ID of the entity being uploaded, so that a re-run of the same
+    work can skip calls applied before. Calls without a key get a unique one,
+    made up of the run which planned them and their sequence number.
+
+    Calls handed over to a batch job are marked as submitted together with
+    ID of the job, so that a resumed run polls the job for their outcome
+    instead of sending them again.
+
+    The journal is a plain text file with one JSON record per line, appended
+    once per state change. Records are kept until `clear' is called.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self.run = uuid.uuid4().hex
+        self._sequence = 0
+
+        # Calls keyed by their identifier and kept in the order in which they
+        # were planned. Each call is a dictionary holding its state, service
+        # and operations not applied yet.
+        self._calls = OrderedDict()
+
+        # Batch jobs keyed by their ID, each holding list of [key, count]
+        # pairs describing calls whose operations were added to the job
+        self._jobs = OrderedDict()
+
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        """ Rebuild journal state from existing file """
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line may be truncated if the run died mid-write
+                    continue
+
+                self._apply(record)
+
+    def _apply(self, record):
+        """ Update in-memory state according to journal record """
+        state = record['state']
+
+        if state == 'submitted':
+            self._jobs[record['job']] = record['calls']
+            for key, _ in record['calls']:
+                if key in self._calls:
+                    self._calls[key]['state'] = state
+            return
+
+        key = record['call']
+
+        if state == 'planned':
+            # Planning a call again replaces the previous attempt
+            self._calls.pop(key, None)
+            self._calls[key] = {
+                'state': state,
+                'service': record['service'],
+                'operations': record['operations'],
+            }
+            return
+
+        call = self._calls.get(key)
+        if call is None:
+            return
+
+        if state == 'discarded':
+            del self._calls[key]
+            return
+
+        call['state'] = state
+        if state == 'applied':
+            call['operations'] = []
+        elif state == 'failed' and record.get('indices') is not None:
+            call['operations'] = [
+                call['operations'][index] for index in record['indices']
+            ]
+
+    def _append(self, records):
+        """ Apply batch of records and append them to the journal file """
+        if not records:
+            return
+
+        lines = ''.join(
+            json.dumps(record, sort_keys=True) + '\n' for record in records
+        )
+
+        with open(self.path, 'a') as journal_file:
+            journal_file.write(lines)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+        for record in records:
+            self._apply(record)
+
+    def state(self, key):
+        """
+        Return state of call identified by `key', i.e. `planned', `applied',
+        `submitted' or `failed', or None if the call is unknown
+        """
+        call = self._calls.get(key)
+        return call['state'] if call is not None else None
+
+    def plan(self, service, operations, key=None):
+        """
+        Record call of given service with `operations' as planned. Return key
+        identifying the call in the journal.
+        """
+        if key is None:
+            key = '{0}-{1}'.format(self.run, self._sequence)
+            self._sequence += 1
+
+        self._append([{
+            'state': 'planned',
+            'call': key,
+            'service': service,
+            'operations': operations,
+        }])
+
+        return key
+
+    def mark_applied(self, keys):
+        """ Record calls identified by `keys' as applied """
+        self._append([
+            {'state': 'applied', 'call': key}
+            for key in keys if key in self._calls
+        ])
+
+    def mark_failed(self, key, indices=None):
+        """
+        Record call identified by `key' as rejected by server. If `indices'
+        is given, only operations at these positions within the call failed,
+        the rest has been applied.
+        """
+        if key not in self._calls:
+            return
+
+        record = {'state': 'failed', 'call': key}
+        if indices is not None:
+            record['indices'] = list(indices)
+
+        self._append([record])
+
+    def mark_submitted(self, job, calls):
+        """
+        Record calls as submitted to batch job with ID `job'. The calls are
+        given as a list of [key, count] pairs in the order in which their
+        operations were added to the job, with key None for calls not
+        recorded in the journal.
+        """
+        self._append([{'state': 'submitted', 'job': job, 'calls': calls}])
+
+    def submitted(self):
+        """
+        Return batch jobs with calls still waiting for their outcome as a list
+        of (job, calls) pairs, with calls in the form given to
+        `mark_submitted'
+        """
+        return [
+            (job, calls) for job, calls in self._jobs.items()
+            if any(self.state(key) == 'submitted' for key, _ in calls)
+        ]
+
+    def discard(self, keys):
+        """ Drop calls identified by `keys' without applying them """
+        self._append([
+            {'state': 'discarded', 'call': key}
+            for key in keys if key in self._calls
+        ])
+
+    def pending(self, failed=False):
+        """
+        Return calls which have been planned but not yet applied as a list of
+        (key, service, operations) tuples in their original order. Failed
+        calls are only included if `failed' is set.
+        """
+        states = ['planned', 'failed'] if failed else ['planned']
+        return [
+            (key, call['service'], call['operations'])
+            for key, call in self._calls.items()
+            if call['state'] in states
+        ]
+
+    def failed(self):
+        """ Return failed calls as a list of (key, service, operations) """
+        return [
+            (key, call['service'], call['operations'])
+            for key, call in self._calls.items()
+            if call['state'] == 'failed'
+        ]
+
+    def clear(self):
+        """ Discard the journal once all work has been completed """
+        self._calls.clear()
+        self._jobs.clear()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import atexit
 import config
+import copy
+import json
 import logging
+import Queue
+import threading
+import time
 
 class ConsoleFormatter(logging.Formatter):
     formats = {
@@ -16,16 +22,143 @@ class ConsoleFormatter(logging.Formatter):
         self._fmt = self.formats.get(record.levelno, self.formats[None])
         return logging.Formatter.format(self, record)
 
-def configure_logging(level=logging.DEBUG):
-    """ Set appropriate log level """
+class JsonFormatter(logging.Formatter):
+    """ Format records as single-line JSON objects """
+
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, sort_keys=True)
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `limit' records from the same call site and level
+    per `interval' seconds. Useful for repetitive per-entity messages, which
+    differ only in their formatted values. Records can be grouped explicitly
+    by passing `extra={'rate_key': ...}' to the logging call.
+    """
+
+    def __init__(self, limit=10, interval=60.0):
+        logging.Filter.__init__(self)
+        self.limit = limit
+        self.interval = interval
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (
+            record.levelno,
+            getattr(record, 'rate_key', None)
+            or (record.pathname, record.lineno),
+        )
+        now = time.time()
+
+        with self._lock:
+            start, count = self._counts.get(key, (now, 0))
+            if now - start >= self.interval:
+                start, count = now, 0
+
+            self._counts[key] = (start, count + 1)
+
+        return count < self.limit
+
+class QueueHandler(logging.Handler):
+    """
+    Handler which only puts records to a queue, leaving the actual output to
+    a QueueListener running in a background thread
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        """
+        Return copy of record with arguments merged into message so that it
+        can be passed on. The original record is left intact for any other
+        handlers.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+class QueueListener(object):
+    """ Background thread passing records from a queue to handlers """
+
+    _sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='QueueListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Write out all queued records and stop the thread """
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is self._sentinel:
+                break
+            self.handle(record)
+
+def configure_logging(level=logging.DEBUG, structured=False, rate_limit=None):
+    """
+    Set appropriate log level. Records are written by a background thread so
+    that logging never blocks on terminal or disk I/O. If `structured' is
+    set, records are written as JSON. If `rate_limit' is given as a (limit,
+    interval) pair, repetitive messages are limited accordingly.
+    """
     for logger in logging.Logger.manager.loggerDict:
         logging.getLogger(logger).setLevel(logging.WARN)
 
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
 
-    plain_formatter = logging.Formatter('[ %(levelname)s ] %(message)s')
-    console_formatter = ConsoleFormatter()
+    if structured:
+        plain_formatter = JsonFormatter()
+        console_formatter = plain_formatter
+    else:
+        plain_formatter = logging.Formatter('[ %(levelname)s ] %(message)s')
+        console_formatter = ConsoleFormatter()
+
+    handlers = []
 
     stream_handler = logging.StreamHandler()
     if stream_handler.stream.isatty():
@@ -33,10 +166,23 @@ def configure_logging(level=logging.DEBUG):
     else:
         stream_handler.setFormatter(plain_formatter)
     stream_handler.setLevel(level)
-    logger.addHandler(stream_handler)
+    handlers.append(stream_handler)
+
+    if config.LOG_FILE is not None:
+        file_handler = logging.FileHandler(config.LOG_FILE)
+        file_handler.setFormatter(plain_formatter)
+        file_handler.setLevel(logging.INFO)
+        handlers.append(file_handler)
+
+    queue = Queue.Queue()
+    queue_handler = QueueHandler(queue)
+    queue_handler.setLevel(min(handler.level for handler in handlers))
+    if rate_limit is not None:
+        queue_handler.addFilter(RateLimitFilter(*rate_limit))
+    logger.addHandler(queue_handler)
 
-    file_handler = logging.FileHandler(config.LOG_FILE)
-    file_handler.setFormatter(plain_formatter)
-    file_handler.setLevel(logging.INFO)
+    listener = QueueListener(queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
 
-    logger.addHandler(file_handler)
+    return listener
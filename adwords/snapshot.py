@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Compact binary snapshots of AdWords account structure
+"""
+
+from __future__ import unicode_literals
+
+import mmap
+import os
+import struct
+import tempfile
+
+
+MAGIC = b'ADWS'
+VERSION = 1
+
+# Columns of the snapshot file in the order in which they are written. Each
+# column is a little-endian array of values of given struct type. Columns
+# ending with `_start' hold (count + 1) offsets into a child table, so that
+# children of i-th item are those between i-th and (i + 1)-th offset.
+COLUMNS = [
+    ('string_start', 'Q'),
+    ('string_data', 'B'),
+    ('campaign_id', 'q'),
+    ('campaign_name', 'I'),
+    ('campaign_ad_group_start', 'I'),
+    ('ad_group_id', 'q'),
+    ('ad_group_name', 'I'),
+    ('ad_group_campaign', 'I'),
+    ('ad_group_ad_start', 'I'),
+    ('ad_group_keyword_start', 'I'),
+    ('ad_group_url_start', 'I'),
+    ('ad_type', 'B'),
+    ('ad_fields', 'I'),
+    ('keyword', 'I'),
+    ('url', 'I'),
+]
+
+# Ad types and the fields stored for each of them
+AD_TYPES = [
+    ('ExpandedTextAd', [
+        'headlinePart1', 'headlinePart2', 'description', 'path1', 'path2',
+        'url',
+    ]),
+    ('DynamicSearchAd', ['description1', 'description2', 'displayUrl']),
+]
+AD_FIELDS = max(len(fields) for _, fields in AD_TYPES)
+
+HEADER = struct.Struct('<4sII')
+COLUMN_HEADER = struct.Struct('<QQ')
+
+
+def write_snapshot(path, campaigns):
+    """ Write campaigns together with their ad groups to snapshot file """
+    strings = ['']
+    string_ids = {'': 0}
+
+    def string(value):
+        value = value or ''
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    columns = dict((name, []) for name, _ in COLUMNS)
+
+    for name in ['campaign_ad_group_start', 'ad_group_ad_start',
+                 'ad_group_keyword_start', 'ad_group_url_start']:
+        columns[name].append(0)
+
+    for campaign in campaigns:
+        columns['campaign_id'].append(campaign.id)
+        columns['campaign_name'].append(string(campaign.name))
+
+        for ad_group in campaign.ad_groups:
+            columns['ad_group_id'].append(ad_group.id)
+            columns['ad_group_name'].append(string(ad_group.name))
+            columns['ad_group_campaign'].append(
+                len(columns['campaign_id']) - 1
+            )
+
+            for ad in ad_group.ads:
+                for ad_type, (type_name, fields) in enumerate(AD_TYPES):
+                    if ad.__class__.__name__ == type_name:
+                        break
+                else:
+                    continue
+
+                columns['ad_type'].append(ad_type)
+                columns['ad_fields'] += [
+                    string(getattr(ad, field)) for field in fields
+                ] + [0] * (AD_FIELDS - len(fields))
+
+            columns['keyword'] += [
+                string(keyword) for keyword in ad_group.keywords
+            ]
+            columns['url'] += [string(url) for url in ad_group.urls]
+
+            columns['ad_group_ad_start'].append(len(columns['ad_type']))
+            columns['ad_group_keyword_start'].append(len(columns['keyword']))
+            columns['ad_group_url_start'].append(len(columns['url']))
+
+        columns['campaign_ad_group_start'].append(
+            len(columns['ad_group_id'])
+        )
+
+    data = bytearray()
+    columns['string_start'].append(0)
+    for value in strings:
+        data += value.encode('utf-8')
+        columns['string_start'].append(len(data))
+    columns['string_data'] = data
+
+    # Column data follows the header, which is padded so that each column
+    # starts aligned to 8 bytes
+    offset = HEADER.size + COLUMN_HEADER.size * len(COLUMNS)
+    header_padding = b'\0' * (-offset % 8)
+    offset += len(header_padding)
+
+    header = [HEADER.pack(MAGIC, VERSION, len(COLUMNS))]
+    body = [header_padding]
+
+    for name, type_code in COLUMNS:
+        values = columns[name]
+        if isinstance(values, bytearray):
+            chunk = bytes(values)
+        else:
+            chunk = struct.pack(
+                '<{0}{1}'.format(len(values), type_code), *values
+            )
+        padding = b'\0' * (-len(chunk) % 8)
+
+        header.append(COLUMN_HEADER.pack(offset, len(values)))
+        body += [chunk, padding]
+        offset += len(chunk) + len(padding)
+
+    # Replace any existing snapshot atomically, so that processes which have
+    # it mapped keep reading the old file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            snapshot_file.write(b''.join(header + body))
+
+        # Temporary files are only readable by their owner, use the same
+        # permissions as a regular new file instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+
+        os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class Column(object):
+    """ Read-only view of single column in memory-mapped snapshot """
+
+    def __init__(self, buffer, offset, count, type_code):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+        self._item = struct.Struct('<' + type_code)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError('column index out of range')
+        return self._item.unpack_from(
+            self._buffer, self._offset + index * self._item.size
+        )[0]
+
+
+class Snapshot(object):
+    """
+    Account snapshot loaded from file. The file is memory-mapped, so that
+    several processes can share a single copy, and entities are only created
+    when accessed.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._mmap = mmap.mmap(
+                snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        magic, version, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{0} is not a valid snapshot'.format(path))
+
+        self._columns = {}
+        for index, (name, type_code) in enumerate(COLUMNS[:count]):
+            offset, length = COLUMN_HEADER.unpack_from(
+                self._mmap, HEADER.size + index * COLUMN_HEADER.size
+            )
+            self._columns[name] = Column(
+                self._mmap, offset, length, type_code
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Unmap snapshot file """
+        self._mmap.close()
+
+    def column(self, name):
+        """ Return column by name """
+        return self._columns[name]
+
+    def string(self, index):
+        """ Return string from string table by its index """
+        start = self._columns['string_start']
+        data = self._columns['string_data']
+        return self._mmap[
+            data._offset + start[index]:data._offset + start[index + 1]
+        ].decode('utf-8')
+
+    def strings(self, column, start, end):
+        """ Return strings referenced by given range of column """
+        column = self._columns[column]
+        return [self.string(column[i]) for i in range(start, end)]
+
+    def campaigns(self):
+        """ Return all campaigns in the snapshot """
+        return [
+            SnapshotCampaign(self, index)
+            for index in range(len(self._columns['campaign_id']))
+        ]
+
+    def ad_groups(self):
+        """ Return all ad groups in the snapshot """
+        return [
+            SnapshotAdGroup(self, index)
+            for index in range(len(self._columns['ad_group_id']))
+        ]
+
+
+class SnapshotEntity(object):
+    """ Base class for read-only entities backed by snapshot """
+
+    __slots__ = ['_snapshot', '_index']
+
+    def __init__(self, snapshot, index):
+        self._snapshot = snapshot
+        self._index = index
+
+    def _children(self, column):
+        """ Return range of child indices stored in `column' """
+        start = self._snapshot.column(column)
+        return start[self._index], start[self._index + 1]
+
+    def __repr__(self):
+        repr = "{0}('{1}')".format(self.__class__.__name__, self.name)
+        return repr.encode('utf-8')
+
+    def __unicode__(self):
+        return self.name
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+class SnapshotCampaign(SnapshotEntity):
+    """ Read-only campaign loaded from snapshot """
+
+    __slots__ = []
+
+    @property
+    def id(self):
+        return self._snapshot.column('campaign_id')[self._index]
+
+    @property
+    def name(self):
+        return self._snapshot.string(
+            self._snapshot.column('campaign_name')[self._index]
+        )
+
+    @property
+    def ad_groups(self):
+        """ Return all ad groups in the campaign """
+        start, end = self._children('campaign_ad_group_start')
+        return [
+            SnapshotAdGroup(self._snapshot, index)
+            for index in range(start, end)
+        ]
+
+
+class SnapshotAdGroup(SnapshotEntity):
+    """ Read-only ad group loaded from snapshot """
+
+    __slots__ = []
+
+    def __hash__(self):
+        return self.id
+
+    def __eq__(self, other):
+        return self.id == other.id
+
+    @property
+    def id(self):
+        return self._snapshot.column('ad_group_id')[self._index]
+
+    @property
+    def name(self):
+        return self._snapshot.string(
+            self._snapshot.column('ad_group_name')[self._index]
+        )
+
+    @property
+    def campaign(self):
+        """ Return campaign to which the ad group belongs """
+        return SnapshotCampaign(
+            self._snapshot,
+            self._snapshot.column('ad_group_campaign')[self._index],
+        )
+
+    @property
+    def ads(self):
+        """ Return all ads in the ad group """
+        start, end = self._children('ad_group_ad_start')
+        return [
+            SnapshotAd(self._snapshot, index) for index in range(start, end)
+        ]
+
+    @property
+    def keywords(self):
+        """ Return all keywords in the ad group sorted by impressions """
+        start, end = self._children('ad_group_keyword_start')
+        return self._snapshot.strings('keyword', start, end)
+
+    @property
+    def top_keyword(self):
+        """ Return keyword with most impressions in the ad group """
+        keywords = self.keywords
+        return keywords[0] if keywords else None
+
+    @property
+    def urls(self):
+        """ Return target URLs of all ads in the ad group """
+        start, end = self._children('ad_group_url_start')
+        return self._snapshot.strings('url', start, end)
+
+
+class SnapshotAd(object):
+    """
+    Read-only ad loaded from snapshot. Fields are available as attributes
+    named the same as in ExpandedTextAd or DynamicSearchAd, depending on the
+    ad type.
+    """
+
+    __slots__ = ['_snapshot', '_index']
+
+    def __init__(self, snapshot, index):
+        self._snapshot = snapshot
+        self._index = index
+
+    @property
+    def type(self):
+        """ Return name of the ad type """
+        return AD_TYPES[self._snapshot.column('ad_type')[self._index]][0]
+
+    def __getattr__(self, name):
+        # Slots may not be set yet, e.g. while copying or unpickling
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        ad_type = self._snapshot.column('ad_type')[self._index]
+        fields = AD_TYPES[ad_type][1]
+        if name not in fields:
+            raise AttributeError(name)
+
+        column = self._snapshot.column('ad_fields')
+        return self._snapshot.string(
+            column[self._index * AD_FIELDS + fields.index(name)]
+        )